@@ -1,10 +1,13 @@
 import asyncio
 from enum import IntEnum
-import json
+import functools
+import logging
+import random
+import ssl
 import time
 
-import requests
-import websockets
+import aiohttp
+import orjson
 
 # Omitting the api version number will go to the default (latest?) version
 BASE_URL = "https://discordapp.com/api"
@@ -19,6 +22,17 @@ class ChannelTypes(IntEnum):
     GROUP_DM = 3
     GUILD_CATEGORY = 4
 
+@functools.lru_cache(maxsize=1024)
+def formatPath(path, formatID):
+    """
+    Formats the path with the ID if it isn't None
+    The same few paths and IDs get used over and over, so the results are cached
+    """
+    if formatID is None:
+        return path
+    # Only format when not-None so we don't get an error
+    return path.format(formatID)
+
 class Route:
     """
     The definition of our Route for our Routes
@@ -30,10 +44,7 @@ class Route:
         """
         Formats the route with the ID if it isn't None
         """
-        if formatID is None:
-            return self.path
-        # Only format when not-None so we don't get an error
-        return self.path.format(formatID)
+        return formatPath(self.path, formatID)
 
 class Routes:
     """
@@ -57,53 +68,107 @@ class DiscordClient:
     """
     def __init__(self, botToken):
         self.botToken = botToken
-        self.session = requests.Session()
-        # Update the authorization header that we will always use
-        self.session.headers.update({"Authorization": f"Bot {botToken}"})
-        # Keep track of all of the rate limits for each of the calls that we make
-        # The channelID, guildID, or webhookID make each rate limit unique
+        # Use a single session for the lifetime of the client so that the connections are kept
+        #  alive and reused between calls
+        # The gateway connection goes through this session too, so it shares the DNS cache and
+        #  the SSL context with all of the REST calls
+        self.session = aiohttp.ClientSession(
+            headers={
+                # The authorization header that we will always use
+                "Authorization": f"Bot {botToken}",
+                # Get the rate limit reset times with millisecond precision instead of seconds
+                "X-RateLimit-Precision": "millisecond",
+            },
+            connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=75, ttl_dns_cache=300,
+                ssl=ssl.create_default_context()),
+            # aiohttp wants the json as a str
+            json_serialize=lambda data: orjson.dumps(data).decode(),
+        )
+        # Keep track of the rate limit bucket that each route uses for each method
+        # Discord gives these to us so that different routes can share the same rate limit
+        self.routeBuckets = {}
+        # Keep track of all of the rate limits for each of the buckets that we have seen
+        # The channelID, guildID, or webhookID make each rate limit unique within the bucket
         self.rateLimits = {}
+        # This bot's guilds. These only change when the bot gets added to or removed from a guild
+        self.myGuilds = None
+        # The connection to the gateway. Only set once we've started initializing
+        self.websocket = None
 
-    def initialize(self):
+    async def initialize(self):
         """
         Initializes the client by making a connection to the websocket gateway, and setting their
         presence to online
         """
-        gatewayBotInfo = self.getGatewayBot()
-        self.websocket = Websocket(gatewayBotInfo["url"], self.botToken)
-        asyncio.get_event_loop().run_until_complete(self.websocket.identify(Status.ONLINE))
+        gatewayBotInfo = await self.getGatewayBot()
+        self.websocket = Websocket(self.session, gatewayBotInfo["url"], self.botToken)
+        await self.websocket.connect(Status.ONLINE)
 
-    def goOffline(self):
+    async def goOffline(self):
+        """
+        Updates the presence of the bot to Offline, and closes the gateway connection and the session
+        Safe to call even if initialize didn't finish
         """
-        Updates the presence of the bot to Offline
-        Can only be called after initialize
+        try:
+            if self.websocket is not None:
+                # There's no one to tell that we're going offline if the connection is already closed
+                if not self.websocket.closed:
+                    await self.websocket.updatePresence(Status.OFFLINE)
+                await self.websocket.close()
+        finally:
+            # Always clean up the session, even if the gateway gave us trouble
+            await self.session.close()
+
+    async def request(self, method, route, formatID=None, **kwargs):
         """
-        asyncio.get_event_loop().run_until_complete(self.websocket.identify(Status.OFFLINE))
+        Makes the request to the Route, formatted with the ID. Any extra arguments are given to
+        the session's request
 
-    def checkResponse(self, response):
+        If we get rate limited, we will wait exactly as long as we are told to and try again
+        Returns the Response
+        """
+        url = route.makeURL(formatID)
+        while True:
+            response = await self.session.request(method, url, **kwargs)
+
+            # Only set the rate limit if they give us some
+            if "X-RateLimit-Bucket" in response.headers:
+                bucket = response.headers["X-RateLimit-Bucket"]
+                self.routeBuckets[(method, route.path)] = bucket
+                # Set the rate limits
+                self.rateLimits[(bucket, formatID)] = {
+                    # The remaining number of requests that can be made in this bucket
+                    "remaining": int(response.headers["X-RateLimit-Remaining"]),
+                    # The time (seconds from the 1970 epoch) that this rate limit will reset
+                    # Use the relative reset time so that our clock doesn't need to match theirs
+                    "reset": time.time() + float(response.headers["X-RateLimit-Reset-After"]),
+                }
+
+            if response.status != 429:
+                return response
+
+            # Wait for the time they give us (in seconds) before trying again
+            retryAfter = float(response.headers["Retry-After"])
+            response.release()
+            await asyncio.sleep(retryAfter)
+
+    async def checkResponse(self, response):
         """
         Checks the Response, and returns the json if it's not a failure
         """
-        # Only set the rate limit if they give us some
-        if "X-RateLimit-Remaining" in response.headers:
-            # Set the rate limits
-            self.rateLimits[response.url] = {
-                # The remaining number of requests to this url
-                "remaining": int(response.headers["X-RateLimit-Remaining"]),
-                # The time (seconds from the 1970 epoch) that this rate limit will reset
-                "reset": int(response.headers["X-RateLimit-Reset"]),
-            }
         response.raise_for_status()
-        return response.json()
+        return await response.json(loads=orjson.loads)
 
-    def atRateLimit(self, url):
+    def atRateLimit(self, method, route, formatID=None):
         """
-        The URL can be created from a Route
+        Checks the rate limit for the method on the Route, formatted with the ID
 
         Returns True if we have hit the rate limit
         """
-        if url in self.rateLimits:
-            rateLimit = self.rateLimits[url]
+        # We can't know the rate limit until we've seen which bucket the route uses
+        bucket = self.routeBuckets.get((method, route.path))
+        rateLimit = self.rateLimits.get((bucket, formatID))
+        if rateLimit is not None:
             # We may still be affected by the rate limit depending on the time
             if rateLimit["remaining"] == 0:
                 # We aren't rate limited if we have gone over the reset time
@@ -113,7 +178,7 @@ class DiscordClient:
         return False
 
     # All of the Channel endpoints
-    def createChannelMessage(self, channelID, content):
+    async def createChannelMessage(self, channelID, content):
         """
         Sends a message to the channel with the content.
         Returns the created message.
@@ -123,11 +188,11 @@ class DiscordClient:
         payload = {
             "content": content
         }
-        return self.checkResponse(
-            self.session.post(Routes.CHANNEL_MESSAGES.makeURL(channelID), json=payload)
+        return await self.checkResponse(
+            await self.request("POST", Routes.CHANNEL_MESSAGES, channelID, json=payload)
         )
 
-    def getChannelMessages(self, channelID, count=None):
+    async def getChannelMessages(self, channelID, count=None):
         """
         Returns a list of messages from the channel. If count is specified, it will get only that
         amount of messages
@@ -138,21 +203,21 @@ class DiscordClient:
         if count is not None:
             query = { "limit": count }
 
-        return self.checkResponse(
-            self.session.get(Routes.CHANNEL_MESSAGES.makeURL(channelID), params=query)
+        return await self.checkResponse(
+            await self.request("GET", Routes.CHANNEL_MESSAGES, channelID, params=query)
         )
 
     # All of the Gateway endpoints
-    def getGatewayBot(self):
+    async def getGatewayBot(self):
         """
         Returns the gateway information for a bot
 
         GET /gateway/bot
         """
-        return self.checkResponse( self.session.get(Routes.GATEWAY_BOT.makeURL()) )
+        return await self.checkResponse( await self.request("GET", Routes.GATEWAY_BOT) )
 
     # All of the Guild endpoints
-    def createGuildChannel(self, guildID, name, channelType, parentID=None):
+    async def createGuildChannel(self, guildID, name, channelType, parentID=None):
         """
         Creates a new channel in the guild. Returns the newly created channel
 
@@ -165,19 +230,19 @@ class DiscordClient:
         # Only set the parent ID if we have one
         if parentID is not None:
             payload["parent_id"] = parentID
-        return self.checkResponse(
-            self.session.post(Routes.GUILD_CHANNELS.makeURL(guildID), json=payload)
+        return await self.checkResponse(
+            await self.request("POST", Routes.GUILD_CHANNELS, guildID, json=payload)
         )
 
-    def getGuildChannels(self, guildID):
+    async def getGuildChannels(self, guildID):
         """
         Returns all of the guild's channels, where the guild is determined by the ID
 
         GET /guilds/{guild.id}/channels
         """
-        return self.checkResponse( self.session.get(Routes.GUILD_CHANNELS.makeURL(guildID)) )
+        return await self.checkResponse( await self.request("GET", Routes.GUILD_CHANNELS, guildID) )
 
-    def modifyGuildChannelPositions(self, guildID, positionPairs):
+    async def modifyGuildChannelPositions(self, guildID, positionPairs):
         """
         Modifies the positions of the channels in the guild. Takes a list of position pairs.
         Each position pair should be a tuple: (channel_id, position)
@@ -189,29 +254,54 @@ class DiscordClient:
             return
 
         payload = [{ "id": pair[0], "position": pair[1] } for pair in positionPairs]
-        self.session.patch(Routes.GUILD_CHANNELS.makeURL(guildID), json=payload).raise_for_status()
+        response = await self.request("PATCH", Routes.GUILD_CHANNELS, guildID, json=payload)
+        # There is no content to read back, so just make sure that the connection gets released
+        response.release()
+        response.raise_for_status()
 
     # All of the User endpoints
-    def getMyGuilds(self):
+    async def getMyGuilds(self):
         """
-        Gets all of this bot's guilds
+        Gets all of this bot's guilds. They are only fetched the first time
 
         GET /users/@me/guilds
         """
-        return self.checkResponse( self.session.get(Routes.USER_ME_GUILDS.makeURL()) )
+        if self.myGuilds is None:
+            self.myGuilds = await self.checkResponse( await self.request("GET", Routes.USER_ME_GUILDS) )
+        return self.myGuilds
+
+class GatewayOpcodes(IntEnum):
+    """
+    These are the opcodes that we use when talking to the gateway
+    """
+    DISPATCH = 0
+    HEARTBEAT = 1
+    IDENTIFY = 2
+    STATUS_UPDATE = 3
+    RESUME = 6
+    RECONNECT = 7
+    INVALID_SESSION = 9
+    HELLO = 10
+    HEARTBEAT_ACK = 11
+
+# These are the close codes that the gateway uses when reconnecting won't help (bad token, etc.)
+FATAL_CLOSE_CODES = {4004, 4010, 4011, 4012, 4013, 4014}
+# The close code that we use when we want to reconnect. Anything but 1000 lets the session be resumed
+RECONNECT_CLOSE_CODE = 4000
 
 def makeWSPayload(opcode, data):
     """
     Returns a json payload to use for a websocket message
     """
-    return json.dumps({
+    # Decode it so that it gets sent as a text frame, since that's what the json transport expects
+    return orjson.dumps({
         "op": opcode,
         "d": data,
-    })
+    }).decode()
 
 class Status:
     """
-    These are the different statuses that can be set with the presence in identify
+    These are the different statuses that can be set with the presence
     """
     ONLINE = "online"
     DO_NOT_DISTURB = "dnd"
@@ -222,29 +312,71 @@ class Status:
 class Websocket:
     """
     Holds the information required to run the websocket commands.
-    
-    Does this all synchronously for simplicity
+
+    The connection to the gateway is kept open (with heartbeats) until it gets closed. Whenever it
+    drops, or Discord asks us to reconnect, it gets reopened and our session is resumed if we can
     """
-    def __init__(self, url, botToken):
+    def __init__(self, session, url, botToken):
         """
-        Determines whether or not to use SSL from the given url
+        The connection will be made with the session, so that it can share the session's connector
         """
-        self.ssl = url.startswith("wss://")
+        self.session = session
         # Add the URL parameters that we will use when connection (version 6 and json transport)
         self.url = f"{url}?v=6&encoding=json"
         self.botToken = botToken
+        # The open connection to the gateway. Only set after connecting
+        self.ws = None
+        # The status that we identify with, so that it stays the same when we reconnect
+        self.status = None
+        # The session that we can resume after reconnecting, and the last sequence number that we
+        #  got from a dispatch. The sequence number also needs to go in the heartbeats
+        self.sessionID = None
+        self.sequence = None
+        # This gets unset when we send a heartbeat, and set again when Discord acknowledges it
+        self.heartbeatAcked = True
+        # The tasks that keep the connection alive while we are connected
+        self.heartbeatTask = None
+        self.watchTask = None
+
+    @property
+    def closed(self):
+        """
+        True if we don't currently have an open connection to the gateway
+        """
+        return self.ws is None or self.ws.closed
+
+    async def connect(self, status):
+        """
+        Connects to the gateway and goes through the identify workflow, setting the presence with
+        the status
+        The connection gets watched from then on, and reopened whenever it drops
+        """
+        self.status = status
+        await self.open(False)
+        self.watchTask = asyncio.get_event_loop().create_task(self.watch())
 
-    async def identify(self, status):
+    async def open(self, resume):
         """
-        Goes through the entire identify workflow, updating the presence with the status
+        Opens the connection to the gateway and starts sending heartbeats
+        Resumes our session if resume is True and we have a session, otherwise identifies
         """
-        async with websockets.connect(self.url, ssl=self.ssl) as ws:
-            # We should be getting a "hello" dispatch immediately
-            # NOTE Do nothing with this since we won't be connected long enough to need a heartbeat
-            await ws.recv()
+        self.ws = await self.session.ws_connect(self.url)
+
+        # We should be getting a "hello" immediately, which tells us how often to send heartbeats
+        hello = await self.ws.receive_json(loads=orjson.loads)
+        # The interval is given to us in milliseconds
+        heartbeatInterval = hello["d"]["heartbeat_interval"] / 1000
 
+        if resume and self.sessionID is not None:
+            # Discord will send us everything that we missed, which gets read in receive
+            await self.ws.send_str(makeWSPayload(GatewayOpcodes.RESUME, {
+                "token": self.botToken,
+                "session_id": self.sessionID,
+                "seq": self.sequence,
+            }))
+        else:
             # Send the actual identify payload
-            await ws.send(makeWSPayload(2, {
+            await self.ws.send_str(makeWSPayload(GatewayOpcodes.IDENTIFY, {
                 "token": self.botToken,
                 "properties": {
                     # Don't think the actual value of this matters very much
@@ -253,10 +385,133 @@ class Websocket:
                     "$device": "BotForNews",
                 },
                 "presence": {
-                    "status": status,
+                    "status": self.status,
                 },
             }))
 
             # Wait for the ready event that they will send back
-            # NOTE Do nothing the ready event
-            await ws.recv()
+            ready = await self.ws.receive_json(loads=orjson.loads)
+            if ready["op"] != GatewayOpcodes.DISPATCH:
+                await self.ws.close()
+                raise RuntimeError(f"Failed to identify with the gateway: {ready}")
+            self.sequence = ready["s"]
+            self.sessionID = ready["d"]["session_id"]
+
+        # Now we can keep the connection alive for as long as we need it
+        self.heartbeatAcked = True
+        self.heartbeatTask = asyncio.get_event_loop().create_task(self.heartbeat(heartbeatInterval))
+
+    async def watch(self):
+        """
+        Reads from the connection, and reopens it whenever it drops or Discord asks us to
+        Stops if the gateway closes the connection with a code that reconnecting won't fix
+        """
+        while True:
+            try:
+                resume = await self.receive()
+            except Exception:
+                logging.exception("Failed to read from the gateway")
+                resume = True
+            self.heartbeatTask.cancel()
+            await self.ws.close(code=RECONNECT_CLOSE_CODE)
+
+            if self.ws.close_code in FATAL_CLOSE_CODES:
+                logging.error(f"The gateway closed the connection for good ({self.ws.close_code})")
+                return
+            if not resume:
+                # We'll need a new session, and Discord wants us to wait a bit before identifying
+                self.sessionID = None
+                await asyncio.sleep(random.uniform(1, 5))
+
+            # Keep trying until we get connected again
+            logging.info("Reconnecting to the gateway")
+            while True:
+                try:
+                    await self.open(resume)
+                    break
+                except Exception:
+                    logging.exception("Failed to reconnect to the gateway")
+                    # Wait at 10 second intervals because Heroku doesn't do well with quick sleeps
+                    await asyncio.sleep(10)
+
+    async def heartbeat(self, interval):
+        """
+        Sends a heartbeat every interval (in seconds) for as long as we are connected
+        If the last heartbeat was never acknowledged, the connection is closed so it can be reopened
+        """
+        while True:
+            await asyncio.sleep(interval)
+            if not self.heartbeatAcked:
+                logging.warning("The gateway stopped acknowledging our heartbeats")
+                await self.ws.close(code=RECONNECT_CLOSE_CODE)
+                return
+            try:
+                await self.sendHeartbeat()
+            except ConnectionError:
+                # The connection has dropped, which gets handled when it gets reopened
+                return
+
+    async def sendHeartbeat(self):
+        """
+        Sends a single heartbeat, which Discord needs to acknowledge before the next one
+        """
+        self.heartbeatAcked = False
+        await self.ws.send_str(makeWSPayload(GatewayOpcodes.HEARTBEAT, self.sequence))
+
+    async def receive(self):
+        """
+        Reads everything that the gateway sends us until the connection closes or Discord asks us
+        to reconnect. Keeps track of the sequence number and the heartbeat acknowledgements
+
+        Returns True if our session can be resumed on a new connection
+        """
+        async for message in self.ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                continue
+            payload = message.json(loads=orjson.loads)
+
+            if payload["op"] == GatewayOpcodes.DISPATCH:
+                # NOTE Do nothing with the events themselves since we don't need any of them
+                self.sequence = payload["s"]
+            elif payload["op"] == GatewayOpcodes.HEARTBEAT:
+                # Discord wants a heartbeat from us right away
+                await self.sendHeartbeat()
+            elif payload["op"] == GatewayOpcodes.HEARTBEAT_ACK:
+                self.heartbeatAcked = True
+            elif payload["op"] == GatewayOpcodes.RECONNECT:
+                return True
+            elif payload["op"] == GatewayOpcodes.INVALID_SESSION:
+                # The data tells us whether or not the session can still be resumed
+                return payload["d"]
+
+        # The connection dropped on its own, so we should be able to pick up where we left off
+        return True
+
+    async def updatePresence(self, status):
+        """
+        Updates the presence with the status over the open connection
+        If we aren't connected right now, the status will be set when we identify again
+        """
+        self.status = status
+        if self.closed:
+            return
+
+        await self.ws.send_str(makeWSPayload(GatewayOpcodes.STATUS_UPDATE, {
+            "since": None,
+            "game": None,
+            "status": status,
+            "afk": False,
+        }))
+
+    async def close(self):
+        """
+        Stops watching the connection and the heartbeats, and closes the connection to the gateway
+        """
+        # We may not have gotten far enough to start both of them
+        tasks = [task for task in (self.watchTask, self.heartbeatTask) if task is not None]
+        for task in tasks:
+            task.cancel()
+        # Wait for them to actually stop. Any errors they had don't matter anymore
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if not self.closed:
+            await self.ws.close()
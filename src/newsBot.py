@@ -1,16 +1,18 @@
 import asyncio
+import collections
 from datetime import datetime
-import json
+import functools
 import logging
 import os
 from pathlib import Path
-import re
-import sched
+import signal
 import time
 
-import twitter
+import aiohttp
+import orjson
 
 from discordClient import ChannelTypes, DiscordClient, Routes
+from twitterClient import TwitterClient
 
 # This is the cache folder that we can use for storing results and stuff
 CACHE = Path("cache")
@@ -18,177 +20,403 @@ CACHE = Path("cache")
 # The path to the info file
 INFO_FILE = Path("info.json")
 
-# This is the format that we will use for our messages
-# With the magic of Discord, the twitter link will be pulled and parsed
-MESSAGE_FORMAT = """URL: https://twitter.com/{screenName}/status/{id}
-Date: {date}{retweetStatus}"""
+# The number of seconds that we will keep using the guild's channels before fetching them again
+# Channels rarely change, and we keep our cached ones up to date with the changes that we make
+# This needs to be well over the 15 minutes between updates, or every update would fetch them
+CHANNELS_CACHE_TTL = 6 * 60 * 60
+
+# The number of seconds that we will keep using the Twitter lists before fetching them again
+# Lists are rarely added or removed, so this saves the rate limit for fetching the tweets
+LISTS_CACHE_TTL = 3600
+
+# The most messages that we will keep waiting to be sent for a single list
+# We stop fetching new posts once we reach this, so that we can't keep piling up messages while
+#  Discord is holding us back
+MESSAGE_QUEUE_LIMIT = 200
+
+# The number of seconds in a Twitter rate limit window
+# We wait this long between updates if we don't know when the next window starts
+RATE_LIMIT_WINDOW = 15 * 60
+
+# The most channels that we will try to create at the same time
+# Discord will only let us create a few channels in a burst before we get rate limited
+CHANNEL_CREATION_LIMIT = 5
+
+def formatMessage(post):
+    """
+    Formats the Twitter post into the message that we will send to Discord
+    With the magic of Discord, the twitter link will be pulled and parsed
+    """
+    retweetStatus = "\n<Retweet>" if post.retweeted_status else ""
+    return (f"URL: https://twitter.com/{post.user.screen_name}/status/{post.id}\n"
+        f"Date: {post.created_at}{retweetStatus}")
 
-DISCORD_MESSAGE_RE = re.compile(r"(\d+)$", re.M)
 def getIDFromMessage(message):
     """
     Extracts the Twitter ID from the message
     Returns that ID or None, if the message doesn't contain a message
     """
-    idMatch = DISCORD_MESSAGE_RE.search(message)
-    if idMatch is not None:
-        return int(idMatch[1])
+    # The ID is always at the end of the URL, on the first line of the message
+    idText = message.partition("/status/")[2].partition("\n")[0]
+    if idText.isdecimal():
+        return int(idText)
 
     return None
 
 class TwitterUpdater:
-    def __init__(self, scheduler, discordClient, twitterClient):
-        self.scheduler = scheduler
+    def __init__(self, discordClient, twitterClient):
+        # The loop that all of our Discord and Twitter calls will be run on
+        self.loop = asyncio.get_event_loop()
         self.discordClient = discordClient
         self.twitterClient = twitterClient
-        # Keep track of the status of all our lists
+        # Keep track of the status of all our lists, and the time that we last fetched them
         self.twitterLists = {}
+        self.twitterListsTime = 0
         # The name for our Discord channel category
         self.categoryName = None
-        # This will be set if we have an overflow of messages that we need to send
-        self.sendingMessages = False
+        # The ID of the guild that we will be putting our channels in
+        self.guildID = None
+        # The guild's channels, and the time that we fetched them
+        self.guildChannels = None
+        self.guildChannelsTime = 0
 
-    def setup(self):
+    async def setup(self):
         """
         Do some first time setup. Should be called only once
         """
-        twitterUser = self.twitterClient.VerifyCredentials()
-        self.updateTwitterLists()
+        twitterUser = await self.runTwitter(self.twitterClient.VerifyCredentials)
+        await self.updateTwitterLists()
         # This is the channel category name that we will use to create twitter account channels
         self.categoryName = f"Twitter For {twitterUser.screen_name}"
 
-        # Get all of this bot's guilds
+        # Get all of this bot's guilds. The guild can't change on us, so only do this once
         # NOTE This assumes that this bot is only a part of a single guild at a time
-        guild = self.discordClient.getMyGuilds()[0]
-        self.guildID = guild["id"]
+        if self.guildID is None:
+            guild = (await self.discordClient.getMyGuilds())[0]
+            self.guildID = guild["id"]
 
-    def updateTwitterLists(self):
+    def runTwitter(self, method, **kwargs):
+        """
+        Runs the blocking Twitter call in the default executor so that it doesn't hold up the loop
+        Returns a future with the result of the call
+        """
+        return self.loop.run_in_executor(None, functools.partial(method, **kwargs))
+
+    async def updateTwitterLists(self):
         """
         This will update the lists that we have created
+        The lists are only fetched again once the ones we have are too old
 
         Shouldn't be called from outside the class
         """
-        lists = self.twitterClient.GetLists()
+        if time.time() - self.twitterListsTime < LISTS_CACHE_TTL:
+            return
+
+        lists = await self.runTwitter(self.twitterClient.GetLists)
+        self.twitterListsTime = time.time()
+
+        # Stop keeping track of any lists that have been deleted
+        listNames = {twitterList.name for twitterList in lists}
+        for listName in [listName for listName in self.twitterLists if listName not in listNames]:
+            removedList = self.twitterLists.pop(listName)
+            # There's no point in sending the rest of its messages anymore
+            if removedList["sendTask"] is not None:
+                removedList["sendTask"].cancel()
+
         for twitterList in lists:
             if twitterList.name not in self.twitterLists:
                 self.twitterLists[twitterList.name] = {
                     # The Twitter id of the list
                     "id": twitterList.id,
+                    # The name that Discord will give the list's channel
+                    "channelName": twitterList.name.lower(),
                     # The ID of the discord channel
                     "channelID": None,
-                    # These are all of the messages that need to be sent to Discord
-                    "messages": [],
+                    # These are all of the messages that need to be sent to Discord, oldest first
+                    "messages": collections.deque(),
+                    # The task that's sending the messages in the background, while it's running
+                    "sendTask": None,
+                    # The ID of the last tweet that we posted to the discord channel
+                    "lastPostedID": None,
+                    # Set once we have found the last posted ID from our cache or from Discord
+                    "lastPostedLoaded": False,
                 }
 
-    def channelMaintenance(self):
+    async def channelMaintenance(self):
         """
         Checks all of the channels for any irregularities
         Creates any channels that are missing (includes the channel category)
         """
-        # Create the channel category if it doesn't exist
-        channelCategory = None
-        currentChannels = self.discordClient.getGuildChannels(self.guildID)
-        for channel in currentChannels:
-            if channel["type"] == ChannelTypes.GUILD_CATEGORY and channel["name"] == self.categoryName:
-                # Looks like we found the channel category
-                channelCategory = channel
+        # Only fetch the channels again once the ones we have are too old
+        if self.guildChannels is None or time.time() - self.guildChannelsTime >= CHANNELS_CACHE_TTL:
+            self.guildChannels = await self.discordClient.getGuildChannels(self.guildID)
+            self.guildChannelsTime = time.time()
+
+        try:
+            await self.arrangeChannels()
+        except aiohttp.ClientResponseError:
+            # Discord refused to use our channels the way that we remember them, so they have been
+            #  changed behind our back (like a deleted category). Fetch them again next time
+            self.guildChannels = None
+            raise
+
+    async def arrangeChannels(self):
+        """
+        Makes sure that our cached channels have the channel category, and a channel for each list
+        in alphabetical order, creating and moving any channels that need it
 
+        Shouldn't be called from outside the class
+        """
+        # Create the channel category if it doesn't exist
+        categoriesByName = {channel["name"]: channel for channel in self.guildChannels
+            if channel["type"] == ChannelTypes.GUILD_CATEGORY}
+        channelCategory = categoriesByName.get(self.categoryName)
         if channelCategory is None:
             # Now we have to create the channel category
-            channelCategory = self.discordClient.createGuildChannel(self.guildID, self.categoryName,
+            channelCategory = await self.discordClient.createGuildChannel(self.guildID, self.categoryName,
                 ChannelTypes.GUILD_CATEGORY)
+            # Keep our cached channels up to date
+            self.guildChannels.append(channelCategory)
 
         # Rip out the channels that aren't underneath our channel category
-        currentChannels = [channel for channel in currentChannels if channel["parent_id"] == channelCategory["id"]]
-
-        # Create any missing Discord channels (the @name (screen_name) for the Twitter accounts)
-        # If it does exist, read the lastest message from it
-        for listName in self.twitterLists:
-            twitterList = self.twitterLists[listName]
-            foundChannel = False
+        currentChannels = [channel for channel in self.guildChannels if channel["parent_id"] == channelCategory["id"]]
+        # Look up our channels by name so that each list can find its channel right away
+        channelsByName = {channel["name"]: channel for channel in currentChannels}
 
+        # Find the channels for any lists that don't know theirs yet
+        missingLists = []
+        for (listName, twitterList) in self.twitterLists.items():
             # Only check for the ID if we don't have it
             if twitterList["channelID"] is None:
-                for channel in currentChannels:
-                    # Chech if we have the correct child category and the name matches
-                    if channel["parent_id"] == channelCategory["id"] and channel["name"] == listName.lower():
-                        # We have found the correct channel so we can also set it in our friends
-                        foundChannel = True
-                        twitterList["channelID"] = channel["id"]
-                        break
-            else:
-                foundChannel = True
-            
-            # Create the missing channel now, and add it to our list so that it be up to date
-            if not foundChannel:
-                # Make sure we're not at the rate limit when creating all these channels
-                # Sleep for 10 seconds before we check the rate limit again
-                # This is needed for Heroku because it doesn't like small sleep times
-                while self.discordClient.atRateLimit(Routes.GUILD_CHANNELS.makeURL(self.guildID)):
-                    time.sleep(10)
-                currentChannels.append(self.discordClient.createGuildChannel(self.guildID,
-                    listName, ChannelTypes.GUILD_TEXT, channelCategory["id"]))
-
-                # Add the channel id to the friend dictionary from the one we just created
-                twitterList["channelID"] = currentChannels[-1]["id"]
+                channel = channelsByName.get(twitterList["channelName"])
+                if channel is not None:
+                    # We have found the correct channel so we can also set it in our friends
+                    twitterList["channelID"] = channel["id"]
+                else:
+                    missingLists.append((listName, twitterList))
+
+        # Create any missing Discord channels all at once, and add them to our list so that it
+        #  will be up to date
+        creationLimit = asyncio.Semaphore(CHANNEL_CREATION_LIMIT)
+        createdChannels = await asyncio.gather(*(
+            self.createListChannel(listName, channelCategory, creationLimit)
+            for (listName, _) in missingLists))
+        for ((_, twitterList), channel) in zip(missingLists, createdChannels):
+            # Add the channel id to the friend dictionary from the one we just created
+            twitterList["channelID"] = channel["id"]
+            currentChannels.append(channel)
+            # Keep our cached channels up to date
+            self.guildChannels.append(channel)
 
         # Make sure that all of the channels are in alphabetical order, first
-        nameSort = lambda channel: channel["name"]
-        oldChannels = currentChannels.copy()
-        currentChannels.sort(key=nameSort)
+        # We only need to remember the IDs to know which channels have moved
+        oldOrder = [channel["id"] for channel in currentChannels]
+        currentChannels.sort(key=lambda channel: channel["name"])
 
         # Update the channels' positions, only if they actually need to change
-        positionPairs = [(channel["id"], i) for (i, channel) in enumerate(currentChannels) if channel != oldChannels[i]]
-        # This will won't do anything if we didn't find any pairs
-        self.discordClient.modifyGuildChannelPositions(self.guildID, positionPairs)
+        positionPairs = [(channel["id"], i) for (i, channel) in enumerate(currentChannels) if channel["id"] != oldOrder[i]]
+        # Nothing needs to change if none of the channels moved
+        if len(positionPairs) == 0:
+            return
+        await self.discordClient.modifyGuildChannelPositions(self.guildID, positionPairs)
+
+        # Put our channels in the new order in the cached channels too, so that we don't try to
+        #  move them again next time
+        self.guildChannels[:] = [channel for channel in self.guildChannels
+            if channel["parent_id"] != channelCategory["id"]] + currentChannels
+
+    async def createListChannel(self, listName, channelCategory, creationLimit):
+        """
+        Creates the channel for the list underneath our channel category
+        The creation limit is a Semaphore that keeps too many channels from being created at once
 
-    def checkMessageRateLimit(self, channelID):
+        Returns the newly created channel
+        """
+        async with creationLimit:
+            # Make sure we're not at the rate limit when creating all these channels
+            # Sleep for 10 seconds before we check the rate limit again
+            # This is needed for Heroku because it doesn't like small sleep times
+            while self.discordClient.atRateLimit("POST", Routes.GUILD_CHANNELS, self.guildID):
+                await asyncio.sleep(10)
+            return await self.discordClient.createGuildChannel(self.guildID, listName,
+                ChannelTypes.GUILD_TEXT, channelCategory["id"])
+
+    def forgetChannel(self, channelID):
+        """
+        Forgets about the channel, for when it's gone from Discord or we can't use it anymore
+        Any list that was using it will get a new one at the next channel maintenance
+        """
+        # Take it out of our cached channels too, or the list would just find it again by its name
+        if self.guildChannels is not None:
+            self.guildChannels[:] = [channel for channel in self.guildChannels if channel["id"] != channelID]
+        for twitterList in self.twitterLists.values():
+            if twitterList["channelID"] == channelID:
+                twitterList["channelID"] = None
+
+    def checkMessageRateLimit(self, method, channelID):
         """
-        Checks the rate limit for the messages for the channel
-        Will schedule another sending messages if we are at the limit
+        Checks the rate limit for the method on the messages for the channel
 
         Returns True if we have hit the rate limit
         """
-        if self.discordClient.atRateLimit(Routes.CHANNEL_MESSAGES.makeURL(channelID)):
-            # We will have to wait at 10 second intervals because the Heroku system doesn't do well
-            #  with quick sleeps
-            self.scheduler.enter(10, 0, self.sendMessages)
-            return True
-
-        return False
+        return self.discordClient.atRateLimit(method, Routes.CHANNEL_MESSAGES, channelID)
 
     def sendMessages(self):
         """
-        Should only be called if messages are being sent
-        Essentially sends all of the messages that are waiting for each friend
+        Starts sending the messages that are waiting for each list, for any list that isn't already
+        sending them
+        The sending carries on in the background, so a backed up channel doesn't hold up the updates
+        """
+        # Each list has its own channel with its own rate limit, so they can all be sent at once
+        for (listName, twitterList) in self.twitterLists.items():
+            # A list without a channel has to wait for the next channel maintenance to get one
+            if (twitterList["sendTask"] is None and twitterList["channelID"] is not None
+                    and len(twitterList["messages"]) > 0):
+                twitterList["sendTask"] = self.loop.create_task(
+                    self.sendListMessages(listName, twitterList))
+
+    async def sendListMessages(self, listName, twitterList):
+        """
+        Sends all of the messages that are waiting for the list to its channel, in order
+        Keeps going until there aren't any left, including any that get added while sending
 
-        If the limit for sending messages has been reached, we will schedule time to try again
+        If the limit for sending messages has been reached, we will wait until we can try again
         """
-        # Always set this to start so that it can't be called again
-        self.sendingMessages = True
-
-        # Find any messages that we need to send
-        for listName in self.twitterLists:
-            twitterList = self.twitterLists[listName]
-            channelID = twitterList["channelID"]
-
-            # Copy the messages so that we can manipulate the list on the friend and be able to
-            #  resume and message sending
-            copiedMessages = twitterList["messages"].copy()
-            for message in copiedMessages:
-                # Only go proceed if are not at the rate limit
-                if not self.checkMessageRateLimit(channelID):
-                    # Send the message to the channel
-                    self.discordClient.createChannelMessage(channelID, message)
-                    # Always pop the first one and the rest will get shifted
-                    twitterList["messages"].pop(0)
-                else:
-                    # We will need to return for now and wait until we get scheduled again
-                    return
+        channelID = twitterList["channelID"]
+        messages = twitterList["messages"]
+        try:
+            while len(messages) > 0:
+                # Only go proceed once we are not at the rate limit
+                # We will have to wait at 10 second intervals because the Heroku system doesn't do
+                #  well with quick sleeps
+                while self.checkMessageRateLimit("POST", channelID):
+                    await asyncio.sleep(10)
+                # Send the message to the channel
+                # Only remove it once it's been sent, so that a failure won't lose the message
+                message = messages[0]
+                await self.discordClient.createChannelMessage(channelID, message)
+                messages.popleft()
+
+                # Remember what we just posted so that we don't have to ask Discord for it
+                twitterList["lastPostedID"] = getIDFromMessage(message)
+                self.saveLastPostedID(listName, twitterList)
+        except aiohttp.ClientResponseError as error:
+            if error.status in (403, 404):
+                # The channel has been deleted, or we can't post in it anymore, so trying again won't
+                #  help. Forget about it so that the next update makes a new one to send these to
+                logging.warning(f"Lost the channel for {listName} ({error.status}), it will be made again")
+                self.forgetChannel(channelID)
+            elif error.status < 500:
+                # Discord will never take this message, so drop it instead of holding up the rest
+                logging.error(f"Discord refused a message for {listName} ({error.status}), dropping it")
+                messages.popleft()
+            else:
+                # Discord is having trouble. Nobody waits on this task, so log it here. The rest get
+                #  sent after the next update
+                logging.exception(f"Failed to send the messages for {listName}")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # The connection gave us trouble, so the rest get sent after the next update
+            logging.exception(f"Failed to send the messages for {listName}")
+        finally:
+            # We are now done sending, so the next update can start again
+            twitterList["sendTask"] = None
+
+    async def stopSending(self):
+        """
+        Stops any sending that's still going on in the background
+        """
+        sendTasks = [twitterList["sendTask"] for twitterList in self.twitterLists.values()
+            if twitterList["sendTask"] is not None]
+        for task in sendTasks:
+            task.cancel()
+        await asyncio.gather(*sendTasks, return_exceptions=True)
 
-        # We are now done sending all of the messages
-        self.sendingMessages = False
+    def saveLastPostedID(self, listName, twitterList):
+        """
+        Saves the ID of the last tweet that we posted for the list in our cache
+        """
+        CACHE.mkdir(exist_ok=True)
+        cachePath = CACHE / f"{listName}.json"
+        # Write to a temporary file first so that crashing can't leave a half-written cache
+        tempPath = cachePath.with_suffix(".tmp")
+        tempPath.write_bytes(orjson.dumps({ "lastPostedID": twitterList["lastPostedID"] }))
+        os.replace(tempPath, cachePath)
+
+    async def loadLastPostedID(self, listName, twitterList):
+        """
+        Finds the ID of the last tweet that we posted for the list from our cache, or from the
+        latest message in the list's channel if we haven't cached it
+        This only needs to be done once since we keep track of it ourselves after that
+
+        Returns False if we couldn't check the channel because of the rate limit
+        """
+        cachePath = CACHE / f"{listName}.json"
+        if cachePath.exists():
+            twitterList["lastPostedID"] = orjson.loads(cachePath.read_bytes())["lastPostedID"]
+        else:
+            # Make sure that we are under the rate limit before we check any messages
+            if self.checkMessageRateLimit("GET", twitterList["channelID"]):
+                return False
+            # Check the latest post in the channel to get the latest tweet id
+            messages = await self.discordClient.getChannelMessages(twitterList["channelID"], 1)
+            # Make sure we at least have a message
+            if len(messages) > 0:
+                twitterList["lastPostedID"] = getIDFromMessage(messages[0]["content"])
+
+        twitterList["lastPostedLoaded"] = True
+        return True
+
+    async def fetchPosts(self, listName, twitterList):
+        """
+        Fetches the newest posts for the Twitter list, and adds them to the list's messages
+        Gets up to the last 100 tweets, but only queues as many as there's room for
+        """
+        # Wait until some of the messages have been sent if we don't have room for any more
+        room = MESSAGE_QUEUE_LIMIT - len(twitterList["messages"])
+        if room <= 0:
+            return
 
-    def doUpdate(self):
+        lastPostID = None
+
+        # Don't check what we posted if we still have messages that we need to send
+        if len(twitterList["messages"]) > 0:
+            # Instead we can check our last message for an ID to check
+            lastPostID = getIDFromMessage(twitterList["messages"][-1])
+        else:
+            if not twitterList["lastPostedLoaded"]:
+                if not await self.loadLastPostedID(listName, twitterList):
+                    # Just return because we can't know the last post right now
+                    return
+            lastPostID = twitterList["lastPostedID"]
+
+        posts = []
+        if lastPostID is None:
+            # Get the latest 100 here since we don't have any posts
+            posts = await self.runTwitter(self.twitterClient.GetListTimeline,
+                list_id=twitterList["id"],
+                count=100,
+                # We don't want extra metadata that we won't use
+                include_entities=False,
+            )
+        else:
+            # Get all of the posts up to the latest one
+            posts = await self.runTwitter(self.twitterClient.GetListTimeline,
+                list_id=twitterList["id"],
+                since_id=lastPostID,
+                count=100,
+                # We don't want extra metadata that we won't use
+                include_entities=False,
+            )
+
+        # Reverse all of the posts since the fetching makes the most recent be first
+        posts.reverse()
+
+        # Format and add the oldest posts that we have room for to our messages
+        # The rest will be fetched again next time, since they come after our last message
+        for post in posts[:room]:
+            twitterList["messages"].append(formatMessage(post))
+
+    async def doUpdate(self):
         # Check that we've been setup
         if self.categoryName is None:
             raise RuntimeError("We haven't been setup yet. Check it out because it's a bug.")
@@ -197,77 +425,86 @@ class TwitterUpdater:
         logging.info(f"Doing a status update at {datetime.today()}")
 
         # Fetch the list of Twitter accounts to look at
-        # We need to do this everytime just in case it got updated recently
-        self.updateTwitterLists()
+        # This only fetches them again if it's been a while, just in case they got updated
+        await self.updateTwitterLists()
         
         # Channels may have changed since the last update
-        self.channelMaintenance()
+        await self.channelMaintenance()
         
         # Fetch the news feeds for the twitter accounts
-        # Get the last 20 tweets if there isnt't any progress in Discord yet
-        for listName in self.twitterLists:
-            twitterList = self.twitterLists[listName]
-            lastPostID = None
-
-            # Don't do any fetching from Discord if we still have messages that we need to send
-            if len(twitterList["messages"]) > 0:
-                # Instead we can check our last message for an ID to check
-                lastPostID = getIDFromMessage(twitterList["messages"][-1])
-            else:
-                # Make sure that we are under the rate limit before we check any messages
-                if self.checkMessageRateLimit(twitterList["channelID"]):
-                    # Just continue because we can't know the last post right now
-                    continue
-                # Check the latest post in each channel to get the latest tweet id
-                messages = self.discordClient.getChannelMessages(twitterList["channelID"], 1)
-                # Make sure we at least have a message
-                if len(messages) > 0:
-                    lastPostID = getIDFromMessage(messages[0]["content"])
-            
-            posts = []
-            if lastPostID is None:
-                # Get the latest 100 here since we don't have any posts
-                posts = self.twitterClient.GetListTimeline(
-                    list_id=twitterList["id"],
-                    count=100,
-                    # We don't want extra metadata that we won't use
-                    include_entities=False,
-                )
-            else:
-                # Get all of the posts up to the latest one
-                posts = self.twitterClient.GetListTimeline(
-                    list_id=twitterList["id"],
-                    since_id=lastPostID,
-                    # We don't want extra metadata that we won't use
-                    include_entities=False,
-                )
-
-            # Reverse all of the posts since the fetching makes the most recent be first
-            posts.reverse()
-
-            # Format and add all of the posts to our messages
-            for post in posts:
-                messageKeywords = {
-                    "id": post.id,
-                    "date": post.created_at,
-                    "screenName": post.user.screen_name,
-                    "retweetStatus": "\n<Retweet>" if post.retweeted_status else "",
-                }
-                twitterList["messages"].append(MESSAGE_FORMAT.format(**messageKeywords))
-
-        # Send all of the messages only if we don't have any messages queued
-        if not self.sendingMessages:
-            self.sendMessages()
+        # Each list is independent of the others, so they can all be fetched at the same time
+        await asyncio.gather(*(self.fetchPosts(listName, twitterList)
+            for (listName, twitterList) in self.twitterLists.items()))
 
-        # Find out the next Twitter API usage reset (15 minute intervals)
-        # nextResetTime = self.twitterClient.CheckRateLimit("/lists/statuses.json").reset
-
-        # Don't schedule anything and just make this a one-shot update
-        # self.scheduler.enterabs(nextResetTime + 1, 0, self.doUpdate)
+        # Start sending all of the new messages
+        self.sendMessages()
 
         # Log the finishing time too
         logging.info(f"Finished a status update at {datetime.today()}")
-        
+
+    async def run(self):
+        """
+        Keeps doing updates until we get cancelled
+        Each update is done once the Twitter API usage resets, so that we have the most to use
+        """
+        try:
+            while True:
+                try:
+                    await self.doUpdate()
+
+                    # Find out the next Twitter API usage reset (15 minute intervals)
+                    rateLimit = await self.runTwitter(self.twitterClient.CheckRateLimit,
+                        url="/lists/statuses.json")
+                    # Use time.time since it uses the same GMT epoch counting method as the Twitter
+                    #  rate limit timing
+                    delay = rateLimit.reset + 1 - time.time()
+                except asyncio.CancelledError:
+                    # This is an Exception before Python 3.8, so make sure that we still stop
+                    raise
+                except Exception:
+                    # One bad response from Twitter or Discord shouldn't take the whole bot down
+                    # Just try again next window, since the sending keeps going in the meantime
+                    logging.exception(f"Failed the status update at {datetime.today()}")
+                    delay = RATE_LIMIT_WINDOW
+
+                # The reset only gets updated when we fetch a timeline, so it can already be over if
+                #  we didn't fetch any. Wait a whole window then, so that we don't keep updating
+                if delay <= 0:
+                    delay = RATE_LIMIT_WINDOW
+                await asyncio.sleep(delay)
+        finally:
+            # The sending can't carry on without us
+            await self.stopSending()
+
+async def run(discordInfo, twitterInfo):
+    """
+    Logs into Discord and Twitter, and keeps doing updates until we get cancelled
+    """
+    discordClient = DiscordClient(discordInfo["botToken"])
+    try:
+        # Log into Discord
+        await discordClient.initialize()
+
+        # Log into Twitter
+        twitterClient = TwitterClient(
+            consumer_key=twitterInfo["apiKey"],
+            consumer_secret=twitterInfo["apiSecretKey"],
+            access_token_key=twitterInfo["accessToken"],
+            access_token_secret=twitterInfo["accessTokenSecret"],
+        )
+
+        # Create the updater that we will use for Twitter
+        twitterUpdater = TwitterUpdater(discordClient, twitterClient)
+        await twitterUpdater.setup()
+
+        await twitterUpdater.run()
+    except asyncio.CancelledError:
+        # Just exit if we get interrupted
+        logging.info("Interrupted")
+    finally:
+        # Log out from any of the clients
+        await discordClient.goOffline()
+
 def main():
     # Set up logging
     logging.basicConfig(level=logging.INFO)
@@ -275,50 +512,33 @@ def main():
     if not INFO_FILE.exists():
         # Check the config variables before we fail
         if "info.json" in os.environ:
-            info = json.loads(os.environ["info.json"])
+            info = orjson.loads(os.environ["info.json"])
         else:
             raise RuntimeError(f"{INFO_FILE} must exist, or the config var must be set")
     else:
         # Read in the info that we need
-        with INFO_FILE.open(encoding="UTF-8") as infoFile:
-            info = json.load(infoFile)
+        info = orjson.loads(INFO_FILE.read_bytes())
 
-    discordInfo = info["discord"]
-    twitterInfo = info["twitter"]
+    # Everything will be run on this one loop, so the gateway heartbeats, Discord calls and
+    #  Twitter calls can all overlap
+    loop = asyncio.get_event_loop()
+    runTask = loop.create_task(run(info["discord"], info["twitter"]))
+
+    # Stop cleanly when we get interrupted, or when Heroku stops us
+    for signalNumber in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signalNumber, runTask.cancel)
+        except NotImplementedError:
+            # Windows doesn't support these, but we will still get a KeyboardInterrupt
+            pass
 
-    # Log into Discord
-    discordClient = DiscordClient(discordInfo["botToken"])
-    discordClient.initialize()
-
-    # Log into Twitter
-    twitterClient = twitter.Api(
-        consumer_key=twitterInfo["apiKey"],
-        consumer_secret=twitterInfo["apiSecretKey"],
-        access_token_key=twitterInfo["accessToken"],
-        access_token_secret=twitterInfo["accessTokenSecret"],
-    )
-
-    # Create our own scheduler
-    # Use time.time since we need for it to be using the same GMT epoch counting method as
-    #  the Twitter rate limit timing
-    scheduler = sched.scheduler(timefunc=time.time)
-
-    # Create the updater that we will use for Twitter
-    twitterUpdater = TwitterUpdater(scheduler, discordClient, twitterClient)
-    twitterUpdater.setup()
-
-    # Add a twitter update to do right once we start running the scheduler
-    scheduler.enter(0, 0, twitterUpdater.doUpdate)
-    
     try:
-        # Run the scheduler forever
-        scheduler.run()
+        loop.run_until_complete(runTask)
     except KeyboardInterrupt:
-        # Just exit if we get interrupted
-        logging.info("Interrupted")
+        # Let the task finish up so that we still go offline
+        runTask.cancel()
+        loop.run_until_complete(runTask)
 
-    # Log out from any of the clients
-    discordClient.goOffline()
     logging.info("Finished")
 
 if __name__ == "__main__":
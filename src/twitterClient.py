@@ -0,0 +1,53 @@
+import requests
+from requests.adapters import HTTPAdapter
+import twitter
+
+class TwitterClient(twitter.Api):
+    """
+    This is the python-twitter Api, except that it keeps its connections alive between calls
+    On its own, python-twitter makes a brand new connection for every call
+
+    NOTE _RequestUrl copies python-twitter's private internals (the credentials, _BuildUrl and the
+    rate limit bookkeeping), so python-twitter is pinned to 3.4.2 in the Pipfile. Check this
+    against the new version before upgrading it
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Use a single session for the lifetime of the client so that the connections are kept
+        #  alive and reused between calls
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Connection": "keep-alive",
+            "User-Agent": "BotForNews",
+        })
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+    def _RequestUrl(self, url, verb, data=None, json=None, enforce_auth=True):
+        """
+        Overrides python-twitter's request so that the GET requests go through our session
+        We only ever make GET requests, so anything else is still left to python-twitter
+        """
+        # The rate limit sleeping is also left to python-twitter, but we don't turn it on
+        if verb != "GET" or self.sleep_on_rate_limit:
+            return super()._RequestUrl(url, verb, data=data, json=json, enforce_auth=enforce_auth)
+
+        # python-twitter keeps the credentials to itself
+        auth = self._Api__auth
+        if enforce_auth and not auth:
+            raise twitter.TwitterError("The twitter.Api instance must be authenticated.")
+
+        if not data:
+            data = {}
+        data["tweet_mode"] = self.tweet_mode
+        url = self._BuildUrl(url, extra_params=data)
+        response = self.session.get(url, auth=auth, timeout=self._timeout, proxies=self.proxies)
+
+        # Keep the rate limits up to date, the same way that python-twitter does
+        if url and self.rate_limit:
+            self.rate_limit.set_limit(url,
+                response.headers.get("x-rate-limit-limit", 0),
+                response.headers.get("x-rate-limit-remaining", 0),
+                response.headers.get("x-rate-limit-reset", 0),
+            )
+
+        return response